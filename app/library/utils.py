@@ -1,9 +1,17 @@
 import pandas as pd
 import re
-from collections import defaultdict
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Tuple
 from datetime import date
 
+_MM_DD_RE = re.compile(r"(\d{1,2}/\d{1,2})")
+_PAYMENT_ID_RE = re.compile(r"(\d+)")
+_DIGITS_RE = re.compile(r"\d+")
+# Matches both first-page header lines in one pass over the page text
+_HEADER_RE = re.compile(
+    r"^Date[^\n]*?(?P<date>\d{1,2}/\d{1,2})|^Payment[^\d\n]*(?P<payment>\d+)",
+    re.M,
+)
+
 
 def get_today_date():
     today = date.today()
@@ -22,7 +30,7 @@ def to_camel_case(text: str) -> str:
 
 def extract_mm_dd(text: str) -> Tuple[bool, Optional[str]]:
     """Extracts MM/DD from text like 'Date: 01/04/2026'."""
-    match = re.search(r"(\d{1,2}/\d{1,2})", text)
+    match = _MM_DD_RE.search(text)
     if match:
         return True, match.group(1).replace("/", "-")
     return False, None
@@ -31,12 +39,24 @@ def extract_mm_dd(text: str) -> Tuple[bool, Optional[str]]:
 def extract_payment_id(text: str) -> Tuple[bool, Optional[str]]:
     """Extracts payment/check ID from text."""
     # Look for patterns like #123456 or similar
-    match = re.search(r"(\d+)", text)
+    match = _PAYMENT_ID_RE.search(text)
     if match:
         return True, match.group(1)
     return False, None
 
 
+def extract_date_check_num(text: str) -> List[str]:
+    """Extracts MM-DD dates and the payment ID from a report's first page."""
+    date_check_num = []
+    for match in _HEADER_RE.finditer(text):
+        if match.group("date"):
+            date_check_num.append(match.group("date").replace("/", "-"))
+        else:
+            date_check_num.append(match.group("payment"))
+            break
+    return date_check_num
+
+
 def extract_key(invoice_num: str, store_names: Dict[str, str], n=-6) -> str:
     z = "0000"
     if not invoice_num:
@@ -44,7 +64,7 @@ def extract_key(invoice_num: str, store_names: Dict[str, str], n=-6) -> str:
 
     # Remove trailing chars if needed
     res_str = str(invoice_num)[:n]
-    digits = re.findall(r"\d+", res_str)
+    digits = _DIGITS_RE.findall(res_str)
 
     if not digits:
         return z
@@ -63,23 +83,32 @@ def extract_key(invoice_num: str, store_names: Dict[str, str], n=-6) -> str:
     return res
 
 
-def get_store_names(
-    csv_path: Optional[str] = None, df: Optional[pd.DataFrame] = None
-) -> Dict[str, str]:
-    def key_formatter(s) -> str:
-        s = str(s).strip()
-        if not s or s.lower() == "nan":
-            return "-1"
+def extract_keys(
+    invoice_nums: pd.Series, store_names: Dict[str, str], n=-6
+) -> pd.Series:
+    """Column-wise extract_key over a Series of invoice numbers."""
+    z = "0000"
+    known = list(store_names)
 
-        if s.startswith("#"):
-            s = s.lstrip("#")
+    # Remove trailing chars if needed
+    res_str = invoice_nums.astype(str).str.slice(stop=n)
 
-        if s.isdigit():
-            # Pad to 4 digits to match Costco's internal keys
-            return s.zfill(4)
+    # Store prefixes repeat across rows, so resolve each distinct one once
+    prefixes = pd.Series(res_str.unique())
+    digits = prefixes.str.extract(r"(\d+)", expand=False)
+
+    res = digits.str.lstrip("0").str.zfill(4)
+    lres = res.str.lstrip("0")
+    rres = res.str.rstrip("0").str.zfill(4)
+
+    fallback = lres.where(lres.isin(known), rres.where(rres.isin(known), z))
+    keys = res.where(res.isin(known), fallback).fillna(z)
+    return res_str.map(dict(zip(prefixes, keys)))
 
-        return "-1"
 
+def get_store_names(
+    csv_path: Optional[str] = None, df: Optional[pd.DataFrame] = None
+) -> Dict[str, str]:
     try:
         if df is None and csv_path:
             df = pd.read_csv(csv_path, header=None)
@@ -95,20 +124,21 @@ def get_store_names(
             else:
                 return {"1997": "C991997", "0000": "Unknown"}
 
-            store_names = defaultdict(str)
-            for x, y in zip(long_col, short_col):
-                formatted_key = key_formatter(y)
-                if formatted_key != "-1":
-                    store_names[formatted_key] = str(x).strip()
+            # object dtype keeps .str usable even when a column is empty
+            keys = short_col.astype(object).map(str).str.strip().str.lstrip("#")
+            mask = keys.str.isdigit()
+            # Pad to 4 digits to match Costco's internal keys
+            keys = keys[mask].str.zfill(4)
+            store_names = dict(
+                zip(keys, long_col[mask].astype(object).map(str).str.strip())
+            )
         else:
-            store_names = defaultdict(str)
+            store_names = {}
 
         # add missed out fields
-        missed = {"1997": "C991997", "0000": "Unknown"}
-        for x, y in missed.items():
-            store_names[x] = y
+        store_names.update({"1997": "C991997", "0000": "Unknown"})
 
-        return dict(store_names)
+        return store_names
     except Exception as e:
         print(f"Error reading stores: {e}")
         return {"1997": "C991997", "0000": "Unknown"}
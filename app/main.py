@@ -1,7 +1,8 @@
-from app.routes.costco import process_costco_analysis
+from app.routes.costco import process_costco_analysis, shutdown_pdf_pool
 from app.routes.sales import process_sales_analysis
 import jinja2
 import os
+from contextlib import asynccontextmanager
 from typing import List, Optional
 from fastapi import FastAPI, File, UploadFile
 from fastapi.responses import HTMLResponse
@@ -12,7 +13,15 @@ template_index = environment.get_template("index.html")
 template_costco = environment.get_template("costco.html")
 template_sales = environment.get_template("sales.html")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Stop the Costco PDF worker pool when the app shuts down"""
+    yield
+    shutdown_pdf_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Store the last analysis result temporarily (in production, use session/cache)
 last_sales_analysis = {}
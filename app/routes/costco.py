@@ -1,19 +1,193 @@
+import asyncio
+import hashlib
+import multiprocessing
 import re
+import traceback
+import pdfplumber
 import pandas as pd
-from typing import List, Optional
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional, Tuple
 from fastapi import File, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse, StreamingResponse
 from io import BytesIO
 from openpyxl import Workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
 from app.library.utils import (
-    extract_key,
+    extract_keys,
     get_store_names,
-    extract_mm_dd,
-    extract_payment_id,
+    extract_date_check_num,
     get_today_date,
 )
 
+_SAFE_NAME_RE = re.compile(r"[\\*?:/\[\]]")
+
+# Parsed store mappings keyed by (reader, content hash), least recently used first
+_STORE_CACHE: "OrderedDict[Tuple[str, bytes], Dict[str, str]]" = OrderedDict()
+_STORE_CACHE_SIZE = 32
+
+# Worker pool for multi-PDF uploads, started on first use and kept for the
+# app's lifetime; stopped by shutdown_pdf_pool() from the app lifespan
+_PDF_POOL: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _PDF_POOL
+    if _PDF_POOL is None:
+        # spawn, since forking a server that already runs threads can deadlock
+        _PDF_POOL = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+    return _PDF_POOL
+
+
+def _discard_pdf_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a broken pool so the next upload starts a fresh one."""
+    global _PDF_POOL
+    if _PDF_POOL is pool:
+        _PDF_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pdf_pool() -> None:
+    """Stop the PDF worker pool, if one was started."""
+    global _PDF_POOL
+    if _PDF_POOL is not None:
+        _PDF_POOL.shutdown(cancel_futures=True)
+        _PDF_POOL = None
+
+
+def _load_store_mapping(
+    content: bytes, read_stores: Callable[..., pd.DataFrame]
+) -> Dict[str, str]:
+    """
+    Parse an uploaded store mapping file, reusing the result when the same
+    file content was uploaded before.
+
+    Args:
+        content: Raw bytes of the upload
+        read_stores: pd.read_csv or pd.read_excel, picked from the file extension
+
+    Returns:
+        Store key to store name mapping
+    """
+    digest = hashlib.blake2b(content, digest_size=16).digest()
+    key = (read_stores.__name__, digest)
+
+    store_mapping = _STORE_CACHE.get(key)
+    if store_mapping is not None:
+        _STORE_CACHE.move_to_end(key)
+        return store_mapping
+
+    store_mapping = get_store_names(df=read_stores(BytesIO(content), header=None))
+    _STORE_CACHE[key] = store_mapping
+    if len(_STORE_CACHE) > _STORE_CACHE_SIZE:
+        _STORE_CACHE.popitem(last=False)
+    return store_mapping
+
+
+def _process_one_pdf(
+    content: bytes, pdf_name: str, store_mapping: Dict[str, str]
+) -> Optional[Tuple[str, Tuple[pd.DataFrame, pd.DataFrame]]]:
+    """
+    Parse one Costco PDF payment report and map its invoices to stores.
+
+    May run in a worker process, so it only takes and returns picklable data.
+
+    Returns:
+        (sheet name, (detail DataFrame, per-store summary)) or None if the
+        PDF has no rows or could not be parsed
+    """
+    try:
+        invoices, order_numbers, descriptions, dates, amounts = [], [], [], [], []
+
+        date_check_num = []
+
+        with pdfplumber.open(BytesIO(content)) as pdf:
+            # Extract tables from all pages
+            for i, page in enumerate(pdf.pages):
+                if i == 0:
+                    # Extract date and payment number from first page
+                    date_check_num = extract_date_check_num(page.extract_text())
+
+                tables = page.extract_tables()
+
+                for table in tables:
+                    if not table or len(table) < 2:
+                        continue
+
+                    # Skip header row (first row)
+                    for row in table[1:]:
+                        if not row or len(row) < 7:
+                            continue
+
+                        try:
+                            invoice = row[0] if row[0] else ""
+                            order_number = row[1] if row[1] else ""
+                            description = row[2] if row[2] else ""
+                            date = row[3] if row[3] else ""
+                            # Skip gross amount (row[4]) and discount (row[5])
+                            amount_str = row[6] if row[6] else "0"
+
+                            # Clean and convert amount
+                            amount_str = amount_str.replace(",", "").strip()
+                            if not amount_str or not invoice:
+                                continue
+
+                            amount = float(amount_str)
+
+                            invoices.append(invoice.strip())
+                            order_numbers.append(order_number.strip())
+                            descriptions.append(description.strip())
+                            dates.append(date.strip())
+                            amounts.append(amount)
+                        except (ValueError, TypeError, IndexError) as e:
+                            # Skip rows that can't be parsed
+                            continue
+
+        if not invoices:
+            return None
+
+        df = pd.DataFrame(
+            {
+                "invoiceNumber": invoices,
+                "orderNumber": order_numbers,
+                "description": descriptions,
+                "date": dates,
+                "amount": amounts,
+            }
+        )
+
+        # Apply mapping logic
+        df["storeKey"] = extract_keys(df["invoiceNumber"], store_mapping)
+        df["storeName"] = df["storeKey"].map(store_mapping).fillna("Unknown")
+
+        # Fix missed mappings with a second try (n=-7); shorter
+        # invoices would retry with n=-6 and map the same way again
+        unknown_mask = (df["storeName"] == "Unknown") & (
+            df["invoiceNumber"].astype(str).str.len() >= 11
+        )
+        if unknown_mask.any():
+            skey = extract_keys(
+                df.loc[unknown_mask, "invoiceNumber"], store_mapping, n=-7
+            )
+            sval = skey.map(store_mapping).fillna("Unknown")
+            df.loc[unknown_mask, ["storeKey", "storeName"]] = pd.concat(
+                [skey, sval], axis=1
+            ).to_numpy()
+
+        df2 = df.groupby("storeName", as_index=False)["amount"].sum()
+
+        try:
+            filename = f"{date_check_num[0]} #{date_check_num[1]}"
+        except Exception as _:
+            filename = pdf_name
+        return filename, (df, df2)
+    except Exception as e:
+        # Log or ignore error for specific file but keep going
+        print(f"Error processing {pdf_name}: {e}")
+        traceback.print_exc()
+        return None
+
 
 async def process_costco_analysis(
     files: Optional[List[UploadFile]] = File(None),
@@ -41,18 +215,19 @@ async def process_costco_analysis(
     # 1. Load Store Mapping
     if store_file and store_file.filename:
         try:
-            content = await store_file.read()
-            filename = store_file.filename.lower()
-            if filename.endswith(".csv"):
-                df_stores = pd.read_csv(BytesIO(content), header=None)
-            elif filename.endswith((".xlsx", ".xls")):
-                df_stores = pd.read_excel(BytesIO(content), header=None)
+            # Only the extension matters, so lowercase just its tail
+            suffix = store_file.filename[-5:].lower()
+            if suffix.endswith(".csv"):
+                read_stores = pd.read_csv
+            elif suffix.endswith((".xlsx", ".xls")):
+                read_stores = pd.read_excel
             else:
                 return HTMLResponse(
                     content="Error: Store mapping file must be .csv or .xlsx",
                     status_code=400,
                 )
-            store_mapping = get_store_names(df=df_stores)
+            content = await store_file.read()
+            store_mapping = _load_store_mapping(content, read_stores)
         except Exception as e:
             return HTMLResponse(
                 content=f"Error loading store mapping: {str(e)}", status_code=400
@@ -63,138 +238,70 @@ async def process_costco_analysis(
             status_code=400,
         )
 
-    # 2. Process PDFs
+    # 2. Read PDFs
+    pdf_contents = []
     if files:
         for file in files:
-            if not file.filename.lower().endswith(".pdf"):
+            if not file.filename or file.filename[-4:].lower() != ".pdf":
                 continue
+            pdf_contents.append((await file.read(), file.filename))
 
-            content = await file.read()
-            try:
-                import pdfplumber
-
-                file_rows = []
-                date_check_num = []
-
-                with pdfplumber.open(BytesIO(content)) as pdf:
-                    # Extract date and payment number from first page
-                    first_page_text = pdf.pages[0].extract_text()
-                    for line in first_page_text.split("\n"):
-                        if line.startswith("Date"):
-                            matched, res = extract_mm_dd(line)
-                            if matched:
-                                date_check_num.append(res)
-                        elif line.startswith("Payment"):
-                            matched, res = extract_payment_id(line)
-                            if matched:
-                                date_check_num.append(res)
-                                break
-
-                    # Extract tables from all pages
-                    for page in pdf.pages:
-                        tables = page.extract_tables()
-
-                        for table in tables:
-                            if not table or len(table) < 2:
-                                continue
-
-                            # Skip header row (first row)
-                            for row in table[1:]:
-                                if not row or len(row) < 7:
-                                    continue
-
-                                try:
-                                    invoice = row[0] if row[0] else ""
-                                    order_number = row[1] if row[1] else ""
-                                    description = row[2] if row[2] else ""
-                                    date = row[3] if row[3] else ""
-                                    # Skip gross amount (row[4]) and discount (row[5])
-                                    amount_str = row[6] if row[6] else "0"
-
-                                    # Clean and convert amount
-                                    amount_str = amount_str.replace(",", "").strip()
-                                    if not amount_str or not invoice:
-                                        continue
-
-                                    amount = float(amount_str)
-
-                                    file_rows.append(
-                                        {
-                                            "invoiceNumber": invoice.strip(),
-                                            "orderNumber": order_number.strip(),
-                                            "description": description.strip(),
-                                            "date": date.strip(),
-                                            "amount": amount,
-                                        }
-                                    )
-                                except (ValueError, TypeError, IndexError) as e:
-                                    # Skip rows that can't be parsed
-                                    continue
-
-                if not file_rows:
-                    continue
-
-                df = pd.DataFrame(file_rows)
-
-                # Apply mapping logic
-                df["storeKey"] = df["invoiceNumber"].apply(
-                    lambda x: extract_key(x, store_mapping)
-                )
-                df["storeName"] = df["storeKey"].map(
-                    lambda key: store_mapping.get(key, "Unknown")
+    # 3. Parse PDFs across worker processes; results keep upload order
+    results = []
+    if len(pdf_contents) == 1:
+        # A single file isn't worth the round trip to a worker process
+        content, pdf_name = pdf_contents[0]
+        results.append(
+            await run_in_threadpool(_process_one_pdf, content, pdf_name, store_mapping)
+        )
+    elif pdf_contents:
+        loop = asyncio.get_running_loop()
+        pool = _get_pdf_pool()
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    pool, _process_one_pdf, content, pdf_name, store_mapping
                 )
+                for content, pdf_name in pdf_contents
+            ),
+            return_exceptions=True,
+        )
 
-                # Fix missed mappings with a second try (n=-7)
-                unknown_mask = df["storeName"] == "Unknown"
-                if unknown_mask.any():
-                    for idx in df[unknown_mask].index:
-                        inv = str(df.loc[idx, "invoiceNumber"])
-                        n = -7 if len(inv) >= 11 else -6
-                        skey = extract_key(inv, store_mapping, n=n)
-                        sval = store_mapping.get(skey, "Unknown")
-                        df.at[idx, "storeKey"] = skey
-                        df.at[idx, "storeName"] = sval
-
-                df2 = df[["storeName", "amount"]].copy()
-                df2 = df2.groupby("storeName", as_index=False).sum()
-
-                try:
-                    filename = f"{date_check_num[0]} #{date_check_num[1]}"
-                except Exception as _:
-                    filename = file.filename
-                detailed_dataframes[filename] = (df, df2)
-
-            except Exception as e:
-                # Log or ignore error for specific file but keep going
-                print(f"Error processing {file.filename}: {e}")
-                import traceback
-
-                traceback.print_exc()
+    for (_, pdf_name), result in zip(pdf_contents, results):
+        if isinstance(result, Exception):
+            # The worker itself failed (crash, OOM); skip the file like a
+            # parse error
+            print(f"Error processing {pdf_name}: {result!r}")
+            traceback.print_exception(result)
+            if isinstance(result, BrokenProcessPool):
+                _discard_pdf_pool(pool)
+            continue
+        if result is not None:
+            filename, df_pair = result
+            detailed_dataframes[filename] = df_pair
 
     # 4. Generate Excel
-    wb = Workbook()
+    wb = Workbook(write_only=True)
     for filename, df_pair in detailed_dataframes.items():
         df, df2 = df_pair
-        safe_name = re.sub(r"[\\*?:/\[\]]", "", filename)[:31]
+        safe_name = _SAFE_NAME_RE.sub("", filename)[:31]
         ws = wb.create_sheet(title=safe_name)
-        for row in dataframe_to_rows(df, index=False, header=True):
+        ws.append(df.columns.tolist())
+        for row in df.itertuples(index=False, name=None):
             ws.append(row)
 
         ws.append([])
-        for row in dataframe_to_rows(df2, index=False, header=True):
+        ws.append(df2.columns.tolist())
+        for row in df2.itertuples(index=False, name=None):
             ws.append(row)
 
         rdate, rcheck = filename.split()
         ws.append([])
-        total = df2["amount"].sum()
+        total = float(df2["amount"].to_numpy().sum())
         ws.append(["Total", total])
         ws.append(["Date", rdate])
         ws.append(["Check Number", rcheck])
 
-    # Remove the default blank sheet created by Workbook()
-    if "Sheet" in wb.sheetnames:
-        wb.remove(wb["Sheet"])
-
     # Save to buffer
     output = BytesIO()
     wb.save(output)
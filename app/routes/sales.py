@@ -1,9 +1,9 @@
 from fastapi.responses import StreamingResponse, HTMLResponse
-from openpyxl.utils.dataframe import dataframe_to_rows
 from io import BytesIO
 from openpyxl import Workbook
 from collections import defaultdict
 from typing import Optional, Dict, Tuple
+import numpy as np
 import pandas as pd
 from fastapi import File, UploadFile
 
@@ -27,8 +27,9 @@ async def process_sales_analysis(
         ), {}
 
     try:
-        content = await file.read()
-        df = pd.read_excel(BytesIO(content))
+        # Parse straight from the upload's spooled file, no bytes copy
+        await file.seek(0)
+        df = pd.read_excel(file.file)
     except Exception as e:
         return HTMLResponse(
             content=f"Error reading Excel file: {str(e)}", status_code=400
@@ -44,43 +45,37 @@ async def process_sales_analysis(
     for i, val in enumerate(df["Cost"].iloc[-4:-1].tolist()):
         expected[keys[i]] = round(float(val), 3)
 
-    # Parse salesperson data
-    sales = defaultdict(lambda: defaultdict(float))
+    # Parse salesperson data, keyed by (salesperson, metric)
+    sales = {}
+    customers = df["Customer"].to_numpy()
+    costs = df["Cost"].to_numpy()
+    is_salesperson = (
+        df["Customer"].astype(str).str.lower().str.startswith("salesperson")
+    ).to_numpy()
     j = -1
 
-    for i, row in df.iterrows():
-        customer = row["Customer"]
+    # Each salesperson row is followed by its three total rows
+    for i in np.flatnonzero(is_salesperson):
         if i <= j:
             continue
-        if isinstance(customer, str):
-            if customer.lower().startswith("salesperson"):
-                salesperson = customer.split(" ")[1]
-                j = i + 3
-                temp = i + 1
-                while temp <= j:
-                    key = "-".join(df["Customer"][temp].lower().strip().split(" "))
-                    amount = df["Cost"][temp]
-                    sales[salesperson][key[:-1]] += float(amount)
-                    temp += 1
-
-    # Aggregate results and remove empty salespersons
-    actual = defaultdict(float)
-    popped = []
-
-    for salesperson, values in sales.items():
-        if sum(values.values()) == 0:
-            popped.append(salesperson)
-            continue
-        actual["period-to-date"] += values["period-to-date"]
-        actual["year-to-date"] += values["year-to-date"]
-        actual["prior-year"] += values["prior-year"]
-
-    for k in popped:
-        sales.pop(k)
-
-    # Round actual values
-    for k in actual:
-        actual[k] = round(actual[k], 3)
+        salesperson = customers[i].split(" ")[1]
+        j = i + 3
+        for customer, amount in zip(customers[i + 1 : j + 1], costs[i + 1 : j + 1]):
+            metric = "-".join(customer.lower().strip().split(" "))[:-1]
+            key = (salesperson, metric)
+            sales[key] = sales.get(key, 0.0) + float(amount)
+
+    # Remove empty salespersons
+    totals = {}
+    for (salesperson, _), amount in sales.items():
+        totals[salesperson] = totals.get(salesperson, 0.0) + amount
+    salespeople = [sp for sp, total in totals.items() if total != 0]
+
+    # Aggregate and round actual values
+    actual = {
+        k: round(sum((sales.get((sp, k), 0.0) for sp in salespeople), 0.0), 3)
+        for k in keys
+    }
 
     # Create validation results
     validation_results = {}
@@ -91,18 +86,30 @@ async def process_sales_analysis(
             "matched": actual[k] == expected[k],
         }
 
-    # Create DataFrame for Excel export
-    sales_df = pd.DataFrame.from_dict(sales, orient="index")
+    # Create DataFrame for Excel export, one row per salesperson with metric
+    # columns in first-seen order; the three known metrics default to 0
+    kept = set(salespeople)
+    metrics = list(dict.fromkeys(k for sp, k in sales if sp in kept))
+    if salespeople:
+        metrics += [k for k in keys if k not in metrics]
+    sales_df = pd.DataFrame(
+        [
+            [sales.get((sp, k), 0.0 if k in keys else None) for k in metrics]
+            for sp in salespeople
+        ],
+        index=salespeople,
+        columns=metrics,
+    )
     sales_df.reset_index(inplace=True)
     sales_df.columns = ["Salesperson"] + list(sales_df.columns[1:])
 
     # Generate Excel workbook
-    wb = Workbook()
-    wb.remove(wb.active)  # Remove default sheet
+    wb = Workbook(write_only=True)
     ws = wb.create_sheet(title="Sales Report")
 
     # Add sales data
-    for row in dataframe_to_rows(sales_df, index=False, header=True):
+    ws.append(sales_df.columns.tolist())
+    for row in sales_df.itertuples(index=False, name=None):
         ws.append(row)
 
     # Add spacing